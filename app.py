@@ -1,19 +1,17 @@
 # gradio_app.py
 
 import os
-import json
-import shutil
-import tempfile
-import re
+import asyncio
 import time
 import gradio as gr
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient
 from query_processor import ResumeMatcher
-from resume_ingest import load_and_split_resumes
+from cache import SemanticCache
+from vector_ops import quantize_int8, to_bson_vectors
+from resume_ingest import dedupe_chunk_texts, hash_file, load_and_split_resumes
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_openai import OpenAIEmbeddings
-from langchain_mongodb import MongoDBAtlasVectorSearch
 
 # ------------------ Load Environment Variables ------------------
 load_dotenv(override=True)
@@ -24,14 +22,18 @@ google_api_key = os.environ.get("GOOGLE_API_KEY")
 
 
 
-client = MongoClient(os.getenv("MONGODB_URI"))
+# Async client so MongoDB round-trips overlap with OpenAI and Gemini calls on Gradio's event loop
+client = AsyncMongoClient(os.getenv("MONGODB_URI"))
 collection = client["rag_db"]["embedded_resumes"]
+# LLM evaluations are cached in their own collection (needs its own "vector_index" in Atlas)
+eval_cache_collection = client["rag_db"]["llm_eval_cache"]
+# One record per file_hash, written only once all of that file's chunks are stored and indexed
+ingested_collection = client["rag_db"]["ingested_files"]
 
 
-embedding = OpenAIEmbeddings(model="text-embedding-ada-002")
+# chunk_size=2048 is the API's per-request input cap, so a whole upload is embedded in as few calls as possible
+embedding = OpenAIEmbeddings(model="text-embedding-ada-002", chunk_size=2048, max_retries=5)
 
-# Ensure the vector store is initialized with the correct collection and embedding model
-vectorstore = MongoDBAtlasVectorSearch(collection=collection, embedding=embedding, index_name="vector_index")
 llm = ChatGoogleGenerativeAI(
     model="gemini-2.0-flash",
     # google_api_key=google_api_key,
@@ -40,17 +42,32 @@ llm = ChatGoogleGenerativeAI(
     timeout=None,
     max_retries=2,
 )
-matcher = ResumeMatcher(vectorstore, llm)
+matcher = ResumeMatcher(collection, embedding, llm, cache=SemanticCache(eval_cache_collection))
 
 # ------------------ Database Management ------------------
 
-def delete_all_resumes_from_db():
+_indexes_ready = False
+
+async def ensure_indexes():
+    """
+    Creates the regular indexes on first use; the async client has to run inside Gradio's event loop.
+    Full resumes are reassembled by an equality match on ID, uploads are deduplicated by file_hash.
+    """
+    global _indexes_ready
+    if not _indexes_ready:
+        await collection.create_index("ID")
+        await collection.create_index("file_hash")
+        await ingested_collection.create_index("file_hash", unique=True)
+        _indexes_ready = True
+
+async def delete_all_resumes_from_db():
     """
     Deletes all existing documents from the MongoDB collection.
     """
     print("Deleting all existing resumes from the database...")
     try:
-        result = collection.delete_many({})
+        result = await collection.delete_many({})
+        await ingested_collection.delete_many({})
         print(f"Successfully deleted {result.deleted_count} documents.")
         # Using a simple gray text for the output message
         return f"<p style='color: #333; text-align: center;'>Successfully deleted {result.deleted_count} resumes from the database.</p>"
@@ -59,99 +76,57 @@ def delete_all_resumes_from_db():
         # Using a distinct red for error messages
         return f"<p style='color: #ef4444; text-align: center;'>Error: {e}</p>"
 
-# ------------------ Gradio Processing Logic ------------------
-
-def process_resumes(resume_files, job_description):
+async def _probe_indexed(doc):
     """
-    Processes uploaded resumes, embeds them, and runs the matching pipeline.
-    Now waits for the documents to be fully indexed using a marker document strategy.
+    Checks whether a stored chunk is searchable yet by querying the vector index with the chunk's own
+    vector, scoped to its file_hash. Reuses the stored embedding, so no embedding call is made.
     """
-    if not resume_files:
-        return "<p style='color: #ef4444; font-size: 1.25rem;'>Please upload at least one resume.</p>"
-
-    import uuid
-    from langchain_core.documents import Document
-
-    temp_dir = tempfile.mkdtemp()
-    temp_resume_paths = []
-
-    try:
-        delete_all_resumes_from_db()
-        # Copy uploaded files to a temporary directory for processing
-        for file_obj in resume_files:
-            src_path = file_obj.name
-            dest_path = os.path.join(temp_dir, os.path.basename(src_path))
-            shutil.copy(src_path, dest_path)
-            temp_resume_paths.append(dest_path)
-
-        # Load, split resumes into chunks
-        chunks = load_and_split_resumes(temp_resume_paths)
-
-        # Add marker document to check when indexing is complete
-        marker_text = f"INDEX_MARKER_{uuid.uuid4()}"
-        marker_doc = Document(page_content=marker_text, metadata={"index_marker": True})
-        chunks.append(marker_doc)
-
-        # Save to vector store
-        MongoDBAtlasVectorSearch.from_documents(
-            documents=chunks,
-            embedding=embedding,
-            collection=collection,
-            index_name="vector_index"
-        )
-        print("Resumes and marker document embedded and saved.")
-
-        # --- Wait for marker to be indexed ---
-        print("Waiting for indexing to complete...")
-        timeout = 60  # seconds
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            try:
-                results = vectorstore.similarity_search(marker_text, k=1)
-                if results and marker_text in results[0].page_content:
-                    print("Indexing complete.")
-                    break
-            except Exception as e:
-                print(f"Waiting for index... {e}")
-            time.sleep(1)
-        else:
-            return "<p style='color: #ef4444; text-align: center;'>Timeout waiting for resumes to be indexed. Please try again.</p>"
-
-        # Run the resume matching pipeline
-        results = matcher.run_pipeline(job_description)
-
-        if not results:
-            return "<p style='color: #333; font-size: 1.25rem; text-align: center;'>No matches found for the provided job description.</p>"
-
-        # -------------------- BUILD RESULTS TABLE --------------------
-        display_table = "<h3 style='font-size: 1.5rem; font-weight: bold; color: #333; text-align: center;'>Top Resume Matches</h3><br>"
-        for res in results:
-            evaluation = res.get('evaluation', 'No evaluation found.')
-
-            # Extract JSON block from LLM response
-            json_match = re.search(r'\{.*\}', evaluation, re.DOTALL)
-            evaluation_json = {}
-            if json_match:
-                json_string = json_match.group(0)
-                try:
-                    evaluation_json = json.loads(json_string)
-                except json.JSONDecodeError as e:
-                    print(f"Failed to parse JSON: {e}")
-                    evaluation_json = {'summary': 'Could not parse JSON response.', 'criteria': []}
-            else:
-                evaluation_json = {'summary': 'No JSON found in LLM response.', 'criteria': []}
-
-            summary = evaluation_json.get('summary', 'Summary not available.')
-            criteria = evaluation_json.get('criteria', [])
-
-            candidate_name = 'N/A'  # Placeholder (can be extracted later if needed)
-
-            display_table += f"""
+    pipeline = [
+        {
+            "$vectorSearch": {
+                "index": "vector_index",
+                "path": "embedding",
+                "queryVector": doc["embedding"],
+                "numCandidates": 20,
+                "limit": 10,
+                "filter": {"file_hash": doc["file_hash"]},
+            }
+        },
+        {"$project": {"_id": 1}},
+    ]
+    hits = await (await collection.aggregate(pipeline)).to_list(length=10)
+    return any(hit["_id"] == doc["_id"] for hit in hits)
+
+async def wait_for_index(probe_docs, timeout=60, poll_interval=0.5):
+    """
+    Polls $vectorSearch until every probe document (the last chunk written for each new file)
+    comes back from the vector index. Probes run one at a time and a poll stops at the first
+    document not yet indexed, so waiting costs about one query per poll. Returns False on timeout.
+    """
+    pending = list(probe_docs)
+    start_time = time.time()
+    while time.time() - start_time < timeout:
+        try:
+            while pending and await _probe_indexed(pending[0]):
+                pending.pop(0)
+            if not pending:
+                print("Indexing complete.")
+                return True
+        except Exception as e:
+            print(f"Waiting for index... {e}")
+        await asyncio.sleep(poll_interval)
+    return False
+
+# ------------------ Result Rendering ------------------
+
+RESULTS_HEADER = "<h3 style='font-size: 1.5rem; font-weight: bold; color: #333; text-align: center;'>Top Resume Matches</h3><br>"
+
+CARD_TMPL = """
             <div style='background-color: #f8f8f8; border: 1px solid #ccc; padding: 20px; margin-bottom: 20px; border-radius: 8px;'>
                 <div style='display: flex; justify-content: space-between; align-items: center; margin-bottom: 15px;'>
-                    <p style='font-size: 1.25rem; font-weight: bold; color: #555;'>Resume ID: {res.get('resume_id', 'N/A')}</p>
+                    <p style='font-size: 1.25rem; font-weight: bold; color: #555;'>Resume ID: {resume_id}</p>
                     
-                    <p style='font-size: 1.25rem; font-weight: bold; color: #555;'>Cosine Similarity: {res.get('cosine_similarity', 'N/A')}</p>
+                    <p style='font-size: 1.25rem; font-weight: bold; color: #555;'>Cosine Similarity: {cosine_similarity}</p>
                 </div>
 
                 <h4 style='font-size: 1.15rem; font-weight: bold; color: #333; margin-top: 0;'>Summary:</h4>
@@ -168,21 +143,113 @@ def process_resumes(resume_files, job_description):
                     </thead>
                     <tbody>
             """
-            for c in criteria:
-                display_table += f"""
+
+ROW_TMPL = """
                         <tr>
-                            <td style='border:1px solid #ccc; padding:10px; font-size:1.05rem; color: #333;'>{c.get('name', 'N/A')}</td>
-                            <td style='border:1px solid #ccc; padding:10px; font-size:1.05rem; color: #333; text-align: center;'>{c.get('score', 'N/A')}</td>
-                            <td style='border:1px solid #ccc; padding:10px; font-size:1.05rem; color: #333;'>{c.get('justification', 'N/A')}</td>
+                            <td style='border:1px solid #ccc; padding:10px; font-size:1.05rem; color: #333;'>{name}</td>
+                            <td style='border:1px solid #ccc; padding:10px; font-size:1.05rem; color: #333; text-align: center;'>{score}</td>
+                            <td style='border:1px solid #ccc; padding:10px; font-size:1.05rem; color: #333;'>{justification}</td>
                         </tr>
                 """
-            display_table += "</tbody></table></div>"
 
-        return display_table
+CARD_FOOTER = "</tbody></table></div>"
+
+def render_results(results):
+    """
+    Renders matcher results as HTML cards. Pieces are collected in a list and joined once.
+    """
+    parts = [RESULTS_HEADER]
+    for res in results:
+        # Evaluations arrive as validated Evaluation objects; None means the LLM call failed
+        evaluation = res.get('evaluation')
+        parts.append(CARD_TMPL.format(
+            resume_id=res.get('resume_id', 'N/A'),
+            cosine_similarity=res.get('cosine_similarity', 'N/A'),
+            summary=evaluation.summary if evaluation else res.get('error', 'No evaluation found.'),
+        ))
+        if evaluation:
+            parts.append("".join(ROW_TMPL.format(**c.model_dump()) for c in evaluation.criteria))
+        parts.append(CARD_FOOTER)
+    return "".join(parts)
+
+# ------------------ Gradio Processing Logic ------------------
 
-    finally:
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+async def process_resumes(resume_files, job_description):
+    """
+    Processes uploaded resumes, embeds the ones not already stored, and runs the matching pipeline.
+    Now waits until the new documents are returned by the vector index before matching.
+    Yields the results HTML again after every finished evaluation, so matches appear as they come in.
+    """
+    if not resume_files:
+        yield "<p style='color: #ef4444; font-size: 1.25rem;'>Please upload at least one resume.</p>"
+        return
+
+    await ensure_indexes()
+
+    # Hash each upload once and keep only resumes not already stored. Uploaded files are parsed
+    # in place, so two uploads sharing a basename never overwrite each other.
+    # resume_names maps each hash to this upload's basename, so results show the current file
+    # name even when the same bytes were first stored under another one.
+    file_hashes = []
+    resume_names = {}
+    new_paths = []
+    new_hashes = []
+    for file_obj in resume_files:
+        src_path = file_obj.name
+        file_hash = hash_file(src_path)
+        if file_hash in resume_names:
+            continue
+        file_hashes.append(file_hash)
+        resume_names[file_hash] = os.path.splitext(os.path.basename(src_path))[0]
+        if await ingested_collection.count_documents({"file_hash": file_hash}, limit=1):
+            continue
+        new_paths.append(src_path)
+        new_hashes.append(file_hash)
+
+    print(f"{len(file_hashes) - len(new_paths)} resumes already in the database, {len(new_paths)} to embed.")
+
+    # Load, split resumes into chunks
+    chunks = await asyncio.to_thread(load_and_split_resumes, new_paths, new_hashes)
+
+    # Chunks left behind by an earlier failed or interrupted ingest of these files are replaced
+    if new_hashes:
+        await collection.delete_many({"file_hash": {"$in": new_hashes}})
+
+    if chunks:
+        # Embed all chunks in batched requests and write the precomputed vectors directly,
+        # using the same document layout MongoDBAtlasVectorSearch expects ("text" / "embedding")
+        # Boilerplate shared across resumes is embedded once; duplicates reuse the vector
+        unique_texts, positions = dedupe_chunk_texts(chunks)
+        print(f"Embedding {len(unique_texts)} unique chunks out of {len(chunks)}.")
+        vectors = await embedding.aembed_documents(unique_texts)
+        # Stored as int8 BSON vectors: 4x smaller than float32 on the wire and in the index
+        vectors = to_bson_vectors(quantize_int8(vectors))
+        docs = [{"text": c.page_content, "embedding": vectors[i], **c.metadata} for c, i in zip(chunks, positions)]
+        await collection.insert_many(docs, ordered=False)
+        print("Resumes embedded and saved.")
+
+        # --- Wait until the last chunk of every new file is returned by the vector index ---
+        # insert_many fills in each doc's _id, which the probe matches against
+        probe_docs = list({d["file_hash"]: d for d in docs}.values())
+        print("Waiting for indexing to complete...")
+        if not await wait_for_index(probe_docs):
+            yield "<p style='color: #ef4444; text-align: center;'>Timeout waiting for resumes to be indexed. Please try again.</p>"
+            return
+
+    # Only now are the new files complete; until then they are re-embedded on the next upload
+    for file_hash in new_hashes:
+        await ingested_collection.update_one({"file_hash": file_hash}, {"$set": {"file_hash": file_hash}}, upsert=True)
+
+    # Run the resume matching pipeline against the uploaded resumes only,
+    # re-rendering in ranking order each time another evaluation completes
+    results = []
+    async for res in matcher.iter_pipeline(job_description, file_hashes=file_hashes, resume_names=resume_names):
+        results.append(res)
+        results.sort(key=lambda r: r["rank"])
+        yield render_results(results)
+
+    if not results:
+        yield "<p style='color: #333; font-size: 1.25rem; text-align: center;'>No matches found for the provided job description.</p>"
 
 # ------------------ Gradio UI ------------------
 
@@ -256,7 +323,7 @@ with gr.Blocks(css=custom_css) as demo:
     
     with gr.Row():
         calculate_btn = gr.Button("Calculate", scale=2)
-        # delete_btn = gr.Button("Delete Old Resumes", scale=1, variant="secondary")
+        delete_btn = gr.Button("Clear DB", scale=1, variant="secondary")
 
     loader_output = gr.HTML(value="", visible=False)
     delete_status_output = gr.HTML(value="")
@@ -274,6 +341,11 @@ with gr.Blocks(css=custom_css) as demo:
         fn=hide_loader,
         outputs=loader_output,
     )
-    
+
+    delete_btn.click(
+        fn=delete_all_resumes_from_db,
+        outputs=delete_status_output,
+    )
+
 
 demo.launch(share=True)
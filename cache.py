@@ -0,0 +1,104 @@
+import hashlib
+from collections import OrderedDict
+from typing import Optional, Union
+
+SIMILARITY_THRESHOLD = 0.97
+
+
+def content_hash(data: Union[str, bytes]) -> str:
+    """blake2b hex digest used for every content-addressed key (files, chunks, resumes, JDs)."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.blake2b(data).hexdigest()
+
+
+class LRUCache:
+    """
+    Minimal least-recently-used mapping. Unlike functools.lru_cache it can hold results of
+    coroutines, since values are stored after they have been awaited.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class SemanticCache:
+    """
+    Caches LLM evaluations in MongoDB, keyed on the job description embedding and pre-filtered
+    on the exact resume. A lookup only hits when the stored JD is semantically close enough AND
+    the resume is byte-identical, so a paraphrased JD reuses the evaluation but another resume never does.
+    The "vector_index" on the cache collection must declare resume_id and resume_hash as filter fields.
+    """
+
+    def __init__(self, collection, index_name="vector_index", threshold=SIMILARITY_THRESHOLD):
+        self.collection = collection
+        self.index_name = index_name
+        self.threshold = threshold
+
+    async def lookup(self, resume_id: str, resume_text: str, job_description: str, key_emb) -> Optional[dict]:
+        # key_emb is the job description embedding, computed (and memoized) by the caller
+        resume_hash = content_hash(resume_text)
+        pipeline = [
+            {
+                "$vectorSearch": {
+                    "index": self.index_name,
+                    "path": "embedding",
+                    "queryVector": key_emb,
+                    "numCandidates": 20,
+                    "limit": 1,
+                    "filter": {"resume_id": resume_id, "resume_hash": resume_hash},
+                }
+            },
+            {
+                "$project": {
+                    "_id": 0,
+                    "resume_id": 1,
+                    "resume_hash": 1,
+                    "content": 1,
+                    "score": {"$meta": "vectorSearchScore"},
+                }
+            },
+        ]
+        try:
+            cursor = await self.collection.aggregate(pipeline)
+            hits = await cursor.to_list(length=1)
+        except Exception as e:
+            print(f"Semantic cache lookup failed: {e}")
+            return None
+        if not hits:
+            return None
+
+        hit = hits[0]
+        # Atlas reports cosine as (1 + cos) / 2; convert back before comparing
+        cosine = 2 * hit.get("score", 0) - 1
+        if cosine <= self.threshold:
+            return None
+        # Lexical guard: near-identical keys for different resumes must never share an answer
+        if hit.get("resume_id") != resume_id or hit.get("resume_hash") != resume_hash:
+            return None
+        return hit.get("content")
+
+    async def store(self, resume_id: str, resume_text: str, job_description: str, content: dict, key_emb):
+        try:
+            await self.collection.insert_one({
+                "resume_id": resume_id,
+                "resume_hash": content_hash(resume_text),
+                "jd_hash": content_hash(job_description),
+                "embedding": key_emb,
+                "content": content,
+            })
+        except Exception as e:
+            print(f"Semantic cache store failed: {e}")
@@ -1,102 +1,218 @@
-from typing import List, Tuple
+import asyncio
+from typing import Dict, List, Optional, Tuple
 from collections import defaultdict
 
-class ResumeMatcher:
-    def __init__(self, vectorstore, llm):
-        self.vectorstore = vectorstore
-        self.llm = llm
+import numpy as np
+from pydantic import BaseModel, Field, ValidationError
 
-    def get_top_resume_ids_from_chunks(self, job_description: str, k=10) -> List[Tuple[str, float]]:
-        # Step 1: Search top-k similar chunks to job description
-        results = self.vectorstore.similarity_search_with_score(job_description, k=k)
-
-        # Step 2: Collect resume IDs and all their similarity scores
-        id_scores = defaultdict(list)
-        for doc, score in results:
-            resume_id = doc.metadata.get("ID")
-            if resume_id:
-                id_scores[resume_id].append(score)
-
-        # Step 3: Sort resume IDs by their best (lowest) similarity score
-        sorted_ids = sorted(id_scores.items(), key=lambda x: min(x[1]))
-
-        # Return a list of tuples: (resume_id, best_similarity_score)
-        return [(rid, min(scores)) for rid, scores in sorted_ids]
-
-    def get_full_resume_by_id(self, resume_id: str) -> str:
-        # Pull all chunks related to this resume
-        docs = self.vectorstore.similarity_search(resume_id, k=100)
-        chunks = [doc.page_content for doc in docs if doc.metadata.get("ID") == resume_id]
-        print(chunks)
-        return "\n".join(chunks)
-        
-    def evaluate_resume_against_jd(self, resume_text: str, job_description: str) -> str:
-        prompt = f"""
-            You are a senior technical recruiter with deep expertise in evaluating software engineering talent.
-
-            Your task is to evaluate a candidate's resume against a job description and return a structured analysis in **valid JSON format**.
-
-            ---
-
-            **Job Description**:
-            {job_description}
-
-            **Candidate Resume**:
-            {resume_text}
-
-            ---
-
-            **Instructions**:
-            1. Identify the **top 2-3 most relevant matching criteria** between the job description and resume.
-            2. For each criterion:
-            - Clearly name the criterion (e.g., "Python", "System Design", etc.)
-            - Give a **score out of 10**
-            - Provide a **justification** (1-2 sentences)
-
-            3. Provide an overall match score out of 10.
-            4. Summarize the match in 2-3 sentences.
-
-            ---
-
-            Important : Return a **pure JSON object** using this exact structure — do not include markdown or Backticks or text before or after:
-
-            json:
-            
-            "criteria": [
-                {{
-                "name": "Criterion Name",
-                "score": 0,
-                "justification": "Reason why the score was given"
-                }},
-                {{
-                "name": "Criterion Name",
-                "score": 0,
-                "justification": "Reason why the score was given"
-                }}
-            ],
-            "overall_score": 0,
-            "summary": "Brief 2-3 sentence summary explaining how well the candidate fits the role."
-            
-            
-            """
-
-        response = self.llm.invoke(prompt)
-        return response.content if hasattr(response, "content") else response
-
-    def run_pipeline(self, job_description: str, top_k=10):
-        print("here")
-        top_resume_ids_with_scores = self.get_top_resume_ids_from_chunks(job_description, k=top_k)
-        results = []
+from cache import LRUCache, content_hash
+from vector_ops import best_per_id, quantize_int8, to_bson_vectors
+
+# Finished pipeline runs kept for exact reruns (same JD against the same stored resumes)
+PIPELINE_CACHE_SIZE = 32
+
+# Upper bound on in-flight Gemini requests, keeps a pipeline run under the RPM limit
+MAX_CONCURRENT_EVALUATIONS = 8
+
+# Built once at import; only the JD and resume are filled in per call.
+PROMPT_TMPL = """\
+You are a senior technical recruiter with deep expertise in evaluating software engineering talent.
+
+Your task is to evaluate a candidate's resume against a job description and return a structured analysis.
+
+---
+
+**Instructions**:
+1. Identify the **top 2-3 most relevant matching criteria** between the job description and resume.
+2. For each criterion:
+- Clearly name the criterion (e.g., "Python", "System Design", etc.)
+- Give a **score out of 10**
+- Provide a **justification** (1-2 sentences)
 
-        for resume_id, similarity_score in top_resume_ids_with_scores:
-            resume_text = self.get_full_resume_by_id(resume_id)
-            evaluation = self.evaluate_resume_against_jd(resume_text, job_description)
-            results.append({
-                "resume_id": resume_id,
-                "cosine_similarity": round(1 - similarity_score, 4),  # convert distance to similarity
-                "evaluation": evaluation
-            })
+3. Provide an overall match score out of 10.
+4. Summarize the match in 2-3 sentences.
 
-        return results
+---
 
-    
\ No newline at end of file
+**Job Description**:
+{job_description}
+
+**Candidate Resume**:
+{resume_text}
+
+"""
+
+class Criterion(BaseModel):
+    name: str = Field(description="Criterion name, e.g. Python or System Design")
+    score: int = Field(description="Score out of 10")
+    justification: str = Field(description="Reason why the score was given, 1-2 sentences")
+
+class Evaluation(BaseModel):
+    criteria: List[Criterion] = Field(description="Top 2-3 matching criteria between the job description and resume")
+    overall_score: int = Field(description="Overall match score out of 10")
+    summary: str = Field(description="Brief 2-3 sentence summary of how well the candidate fits the role")
+
+class ResumeMatcher:
+    def __init__(self, collection, embedding, llm, cache=None, max_concurrency=MAX_CONCURRENT_EVALUATIONS):
+        # collection is an async (pymongo AsyncMongoClient) collection of resume chunks
+        self.collection = collection
+        self.embedding = embedding
+        self.llm = llm
+        # Validated Evaluation objects straight from the LLM, no string parsing on our side
+        self.structured_llm = llm.with_structured_output(Evaluation)
+        # Optional SemanticCache consulted before every LLM call
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        # Per-instance memo of JD embeddings so repeated runs skip the embedding call
+        self._jd_embeddings = LRUCache(maxsize=256)
+        # Exact-match memo of whole runs, layered below the semantic cache
+        self._pipeline_cache = LRUCache(maxsize=PIPELINE_CACHE_SIZE)
+
+    async def embed_jd(self, job_description: str) -> np.ndarray:
+        jd_hash = content_hash(job_description)
+        q = self._jd_embeddings.get(jd_hash)
+        if q is None:
+            # Shared between callers through the memo, so callers must not modify it in place
+            q = np.asarray(await self.embedding.aembed_query(job_description), dtype=np.float32)
+            self._jd_embeddings.put(jd_hash, q)
+        return q
+
+    @staticmethod
+    def _scope_filter(file_hashes: Optional[List[str]]) -> dict:
+        # Restricts a query to the given uploaded files; None searches every stored resume
+        return {} if file_hashes is None else {"file_hash": {"$in": list(file_hashes)}}
+
+    def _vector_search_stage(self, q: np.ndarray, num_candidates: int, limit: int, file_hashes: Optional[List[str]]) -> dict:
+        stage = {
+            "index": "vector_index",
+            "path": "embedding",
+            # Stored vectors are int8, so the query is quantized the same way
+            "queryVector": to_bson_vectors(quantize_int8(q))[0],
+            "numCandidates": num_candidates,
+            "limit": limit,
+        }
+        scope = self._scope_filter(file_hashes)
+        if scope:
+            stage["filter"] = scope
+        return {"$vectorSearch": stage}
+
+    async def get_top_resume_ids_from_chunks(self, job_description: str, k=10, file_hashes: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        # Step 1: Search top-k similar chunks, fetching only the resume's file hash and score.
+        # Resumes are keyed by content hash, so two files sharing a basename never merge.
+        pipeline = [
+            self._vector_search_stage(await self.embed_jd(job_description), max(200, k), k, file_hashes),
+            {"$project": {"_id": 0, "file_hash": 1, "score": {"$meta": "vectorSearchScore"}}},
+        ]
+        results = await (await self.collection.aggregate(pipeline)).to_list(length=k)
+
+        results = [r for r in results if r.get("file_hash")]
+
+        # Step 2: Cosine distances for all hits in one vectorized pass
+        # (Atlas reports cosine as (1 + cos) / 2, so distance = 1 - cos = 2 - 2 * score)
+        ids = np.array([r["file_hash"] for r in results])
+        distances = 2 - 2 * np.array([r["score"] for r in results], dtype=np.float32)
+
+        # Step 3: Best (lowest) distance per resume via sort + np.minimum.reduceat, best match first
+        return best_per_id(ids, distances)
+
+    async def get_full_resumes_by_ids(self, file_hashes: List[str]) -> Dict[str, Tuple[str, str]]:
+        # Pull all chunks of every requested resume in a single round-trip, grouped by file hash.
+        # Returns file_hash -> (stored ID, full text); the ID is the name the file was first ingested under.
+        chunks = defaultdict(list)
+        names = {}
+        async for d in self.collection.find({"file_hash": {"$in": list(file_hashes)}}, {"text": 1, "ID": 1, "file_hash": 1, "_id": 0}):
+            chunks[d["file_hash"]].append(d["text"])
+            names.setdefault(d["file_hash"], d.get("ID", "N/A"))
+        return {fh: (names.get(fh, "N/A"), "\n".join(chunks.get(fh, []))) for fh in file_hashes}
+        
+    async def evaluate_resume_against_jd(self, resume_id: str, resume_text: str, job_description: str) -> Evaluation:
+        key_emb = None
+        if self.cache is not None:
+            key_emb = (await self.embed_jd(job_description)).tolist()
+            cached = await self.cache.lookup(resume_id, resume_text, job_description, key_emb)
+            if cached is not None:
+                try:
+                    evaluation = Evaluation.model_validate(cached)
+                except ValidationError:
+                    # Entries written before structured output hold raw LLM strings; re-evaluate instead
+                    print(f"Ignoring unreadable semantic cache entry for {resume_id}")
+                else:
+                    print(f"Semantic cache hit for {resume_id}")
+                    return evaluation
+
+        prompt = PROMPT_TMPL.format(job_description=job_description, resume_text=resume_text)
+
+        evaluation = await self.structured_llm.ainvoke(prompt)
+        if evaluation is None:
+            # with_structured_output yields None when Gemini answers without the schema's tool call
+            raise ValueError("LLM returned no structured evaluation")
+
+        if self.cache is not None:
+            await self.cache.store(resume_id, resume_text, job_description, evaluation.model_dump(), key_emb)
+        return evaluation
+
+    async def _eval_one(self, semaphore: asyncio.Semaphore, rank: int, file_hash: str, resume_id: str, similarity_score: float, resume_text: str, job_description: str) -> dict:
+        result = {
+            "rank": rank,
+            "file_hash": file_hash,
+            "resume_id": resume_id,
+            "cosine_similarity": round(1 - similarity_score, 4),  # convert distance to similarity
+            "evaluation": None
+        }
+        try:
+            async with semaphore:
+                # Evaluations are cached per file hash, which stays stable when a file is renamed
+                result["evaluation"] = await self.evaluate_resume_against_jd(file_hash, resume_text, job_description)
+        except Exception as e:
+            # A failed evaluation must not take the whole page down
+            print(f"Evaluation failed for {resume_id}: {e}")
+            result["error"] = f"Evaluation failed: {e}"
+        return result
+
+    async def iter_pipeline(self, job_description: str, top_k=10, file_hashes: Optional[List[str]] = None, resume_names: Optional[Dict[str, str]] = None):
+        """
+        Yields each result as soon as its evaluation completes, so callers can render progressively.
+        Results arrive in completion order; "rank" gives their position in the similarity ranking.
+        resume_names maps file_hash -> the name to show as "resume_id"; files not in it keep the
+        ID they were first ingested under.
+        """
+        resume_names = resume_names or {}
+
+        def label(res: dict) -> dict:
+            return {**res, "resume_id": resume_names.get(res["file_hash"], res["resume_id"])}
+
+        # Keyed on content hashes only: the same bytes under a new name (or re-uploaded after
+        # clearing the DB) hit the same entry, so names are applied on the way out, never cached
+        stored_hashes = frozenset(await self.collection.distinct("file_hash", self._scope_filter(file_hashes)))
+        cache_key = (content_hash(job_description), stored_hashes, top_k)
+        cached = self._pipeline_cache.get(cache_key)
+        if cached is not None:
+            print("Pipeline cache hit")
+            for res in cached:
+                yield label(res)
+            return
+
+        top_resumes_with_scores = await self.get_top_resume_ids_from_chunks(job_description, top_k, file_hashes)
+
+        resumes = await self.get_full_resumes_by_ids([fh for fh, _ in top_resumes_with_scores])
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = []
+        for rank, (fh, score) in enumerate(top_resumes_with_scores):
+            stored_id, resume_text = resumes[fh]
+            tasks.append(asyncio.create_task(self._eval_one(semaphore, rank, fh, stored_id, score, resume_text, job_description)))
+        results = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                res = await next_done
+                results.append(res)
+                yield label(res)
+        finally:
+            # Stop outstanding LLM calls if the consumer goes away early
+            for task in tasks:
+                task.cancel()
+
+        # Only complete, non-empty, error-free runs are reused; anything else is recomputed next time.
+        # Callers run the pipeline only after the scoped files are confirmed searchable (wait_for_index).
+        if results and not any("error" in res for res in results):
+            self._pipeline_cache.put(cache_key, sorted(results, key=lambda res: res["rank"]))
@@ -1,32 +1,77 @@
 import os
-from typing import List
-from langchain_community.document_loaders import PyPDFLoader
+from typing import List, Tuple
+import pypdfium2 as pdfium
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
+from cache import content_hash
 
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 50
 
-def load_and_split_resumes(resume_files: List[str]) -> List[Document]:
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        separators=["\n\n", "\n", ".", "!", "?", ",", " "]
-    )
+def hash_file(path: str) -> str:
+    """Content hash identifying a resume PDF regardless of its file name."""
+    with open(path, "rb") as f:
+        return content_hash(f.read())
+
+def _extract_text(path: str) -> str:
+    pdf = pdfium.PdfDocument(path)
+    try:
+        text = " ".join(page.get_textpage().get_text_range() for page in pdf)
+    finally:
+        pdf.close()
+    # PDFium reports line breaks as \r\n; normalize so chunks, embeddings and prompts only see \n
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+# Built once and shared by every upload
+_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    separators=["\n\n", "\n", ".", "!", "?", ",", " "],
+    length_function=len,
+    is_separator_regex=False
+)
+
+def _metadata(path: str, file_hash: str) -> dict:
+    return {
+        "source": os.path.basename(path),
+        "ID": os.path.splitext(os.path.basename(path))[0],
+        "file_hash": file_hash
+    }
+
+def load_and_split_resumes(resume_files: List[str], file_hashes: List[str]) -> List[Document]:
+    """
+    Parses and splits the given PDFs. file_hashes[i] is the hash_file() digest of resume_files[i],
+    computed once by the caller and stored on every chunk of that file.
+    """
+    if not resume_files:
+        return []
+
+    # Split raw text and attach metadata directly, skipping split_documents' per-document copies.
+    # PDFium is not thread-safe, so files are parsed one after another.
     all_chunks = []
-    
-    for path in resume_files:
-        loader = PyPDFLoader(path)
-        pages = loader.load()
-        full_text = " ".join([p.page_content for p in pages])
-        doc = Document(
-            page_content=full_text,
-            metadata={
-                "source": os.path.basename(path),
-                "ID": os.path.splitext(os.path.basename(path))[0]
-            }
+    for path, file_hash in zip(resume_files, file_hashes):
+        full_text = _extract_text(path)
+        metadata = _metadata(path, file_hash)
+        all_chunks.extend(
+            Document(page_content=chunk, metadata=dict(metadata))
+            for chunk in _SPLITTER.split_text(full_text)
         )
-        chunks = splitter.split_documents([doc])
-        all_chunks.extend(chunks)
-    
+
     return all_chunks
+
+def dedupe_chunk_texts(chunks: List[Document]) -> Tuple[List[str], List[int]]:
+    """
+    Collapses chunks with identical content so each distinct text is embedded once.
+    Returns the unique texts and, for every chunk, the index of its text in that list.
+    """
+    unique_texts = []
+    index_of = {}
+    positions = []
+    for c in chunks:
+        h = content_hash(c.page_content)
+        if h not in index_of:
+            index_of[h] = len(unique_texts)
+            unique_texts.append(c.page_content)
+        positions.append(index_of[h])
+    return unique_texts, positions
@@ -0,0 +1,34 @@
+from typing import List, Tuple
+
+import numpy as np
+from bson.binary import Binary, BinaryVectorDtype
+
+
+def best_per_id(ids: np.ndarray, distances: np.ndarray) -> List[Tuple[str, float]]:
+    """Groups distances by ID and returns (id, best distance) pairs, best match first."""
+    if len(ids) == 0:
+        return []
+    order = np.argsort(ids, kind="stable")
+    ids_sorted, dist_sorted = ids[order], distances[order]
+    uniq, starts = np.unique(ids_sorted, return_index=True)
+    best = np.minimum.reduceat(dist_sorted, starts)
+    ranked = np.argsort(best, kind="stable")
+    return [(str(uniq[i]), float(best[i])) for i in ranked]
+
+
+def quantize_int8(vectors) -> np.ndarray:
+    """
+    Scalar-quantizes float vectors to int8, scaling each row so its largest component maps to 127.
+    Per-row scaling keeps the full int8 range for small-magnitude embeddings and does not change
+    cosine similarity, which is scale-invariant.
+    """
+    V = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    max_abs = np.abs(V).max(axis=1, keepdims=True)
+    scale = np.divide(127.0, max_abs, out=np.zeros_like(max_abs), where=max_abs > 0)
+    return np.clip(np.round(V * scale), -128, 127).astype(np.int8)
+
+
+def to_bson_vectors(quantized: np.ndarray) -> List[Binary]:
+    """Packs int8 rows as BSON binary vectors (subtype 9) for Atlas Vector Search."""
+    return [Binary.from_vector(row.tolist(), BinaryVectorDtype.INT8) for row in quantized]
+